@@ -0,0 +1,55 @@
+"""
+dbt Documentation DAG
+
+This DAG regenerates the dbt docs site (manifest and catalog) for the FHIR project.
+Docs only need to follow the models loosely, so this runs hourly instead of after
+every transform run.
+
+Schedule: Hourly
+Dependencies: None - reads whatever dbt_transform_fhir last built in Snowflake
+"""
+
+from datetime import datetime, timedelta
+from airflow import DAG
+from airflow.operators.bash import BashOperator
+
+# Default arguments for the DAG
+default_args = {
+    'owner': 'airflow',
+    'depends_on_past': False,
+    'start_date': datetime(2026, 1, 1),
+    'email_on_failure': False,
+    'email_on_retry': False,
+    'retries': 1,
+    'retry_delay': timedelta(minutes=5),
+    'execution_timeout': timedelta(minutes=30),  # Kill hung dbt commands
+}
+
+# DAG Configuration
+dag = DAG(
+    'dbt_docs_fhir',
+    default_args=default_args,
+    description='Generate dbt documentation for the FHIR project',
+    schedule_interval='@hourly',
+    max_active_runs=1,
+    catchup=False,
+    tags=['dbt', 'documentation', 'fhir'],
+)
+
+# dbt project directory
+DBT_PROJECT_DIR = '/opt/airflow/dbt'
+DBT_PROFILES_DIR = '/opt/airflow/dbt'
+
+# Separate target path so docs generation never overwrites the run_results.json
+# that dbt_transform_fhir is parsing
+DBT_DOCS_TARGET_PATH = 'target/docs'
+
+# Generate dbt documentation
+dbt_docs_generate = BashOperator(
+    task_id='dbt_docs_generate',
+    bash_command=(
+        f'cd {DBT_PROJECT_DIR} && dbt docs generate --profiles-dir {DBT_PROFILES_DIR} '
+        f'--target-path {DBT_DOCS_TARGET_PATH}'
+    ),
+    dag=dag,
+)
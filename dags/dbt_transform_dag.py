@@ -2,10 +2,12 @@
 dbt FHIR Transformation DAG
 
 This DAG orchestrates dbt transformations on FHIR data in Snowflake.
-It runs staging, intermediate, and marts models in sequence with testing.
+It runs staging, intermediate, and marts models in a single dbt run, then tests.
+Documentation is generated separately by the hourly dbt_docs_fhir DAG.
 
-Schedule: Every 10 minutes
-Dependencies: Waits for s3_to_snowflake_load DAG to complete
+Schedule: None (triggered by the s3_to_snowflake_load DAG)
+Dependencies: Started by s3_to_snowflake_load's trigger_dbt_transform task
+once new files are loaded, so no sensor is needed
 """
 
 from datetime import datetime, timedelta
@@ -13,8 +15,8 @@ from airflow import DAG
 from airflow.operators.bash import BashOperator
 from airflow.operators.python import PythonOperator
 import logging
-import json
 import os
+import orjson
 
 # Default arguments for the DAG
 default_args = {
@@ -25,6 +27,7 @@ default_args = {
     'email_on_retry': False,
     'retries': 1,
     'retry_delay': timedelta(minutes=2),
+    'execution_timeout': timedelta(minutes=30),  # Kill hung dbt commands
 }
 
 # DAG Configuration
@@ -41,15 +44,30 @@ dag = DAG(
 # dbt project directory
 DBT_PROJECT_DIR = '/opt/airflow/dbt'
 DBT_PROFILES_DIR = '/opt/airflow/dbt'
+DBT_THREADS = 8
+
+# Written after the first successful `dbt --version`; /tmp is reset when the container is rebuilt
+DBT_VERIFIED_SENTINEL = '/tmp/.dbt_verified'
+
+# `dbt deps` is skipped while this sentinel (keyed on the packages.yml hash) and dbt_packages exist
+DBT_DEPS_SENTINEL = f'/tmp/.dbt_deps_$(sha256sum {DBT_PROJECT_DIR}/packages.yml | cut -c1-16)'
 
 
 def check_dbt_installation(**context):
-    """Verify dbt is installed and accessible."""
+    """
+    Verify dbt is installed and accessible.
+    The check runs once per container; later runs only test for the sentinel file.
+    """
     import subprocess
     
+    if os.path.exists(DBT_VERIFIED_SENTINEL):
+        logging.info('dbt installation already verified in this container')
+        return 'dbt is installed'
+    
     try:
-        result = subprocess.run(['dbt', '--version'], capture_output=True, text=True, check=True)
+        result = subprocess.run(['dbt', '--version'], capture_output=True, text=True, check=True, timeout=120)
         logging.info(f'dbt version: {result.stdout}')
+        open(DBT_VERIFIED_SENTINEL, 'w').close()
         return 'dbt is installed'
     except subprocess.CalledProcessError as e:
         logging.error(f'dbt not found or error: {e}')
@@ -57,6 +75,9 @@ def check_dbt_installation(**context):
     except FileNotFoundError:
         logging.error('dbt command not found in PATH')
         raise
+    except subprocess.TimeoutExpired:
+        logging.error('dbt --version did not finish within 120 seconds')
+        raise
 
 
 def parse_dbt_results(**context):
@@ -70,13 +91,22 @@ def parse_dbt_results(**context):
         return
     
     try:
-        with open(results_path, 'r') as f:
-            results = json.load(f)
+        with open(results_path, 'rb') as f:
+            results = orjson.loads(f.read())
+        
+        # Tally statuses and collect failures in a single pass
+        counts = {'success': 0, 'error': 0, 'skipped': 0}
+        failed_results = []
+        for result in results.get('results', []):
+            status = result.get('status')
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'error':
+                failed_results.append(result)
         
-        total_models = len(results.get('results', []))
-        successful = sum(1 for r in results.get('results', []) if r.get('status') == 'success')
-        failed = sum(1 for r in results.get('results', []) if r.get('status') == 'error')
-        skipped = sum(1 for r in results.get('results', []) if r.get('status') == 'skipped')
+        total_models = sum(counts.values())
+        successful = counts['success']
+        failed = counts['error']
+        skipped = counts['skipped']
         
         logging.info(f'=== dbt {task_id} Summary ===')
         logging.info(f'Total models: {total_models}')
@@ -88,11 +118,10 @@ def parse_dbt_results(**context):
         
         if failed > 0:
             logging.error('Failed models:')
-            for result in results.get('results', []):
-                if result.get('status') == 'error':
-                    model_name = result.get('unique_id', 'unknown')
-                    error_msg = result.get('message', 'No error message')
-                    logging.error(f'  - {model_name}: {error_msg}')
+            for result in failed_results:
+                model_name = result.get('unique_id', 'unknown')
+                error_msg = result.get('message', 'No error message')
+                logging.error(f'  - {model_name}: {error_msg}')
         
         return {'total': total_models, 'successful': successful, 'failed': failed, 'skipped': skipped}
     except Exception as e:
@@ -107,57 +136,37 @@ check_dbt = PythonOperator(
     dag=dag,
 )
 
-# Task 2: Install dbt packages
+# Task 2: Install dbt packages (only when packages.yml changed or dbt_packages is missing)
 dbt_deps = BashOperator(
     task_id='dbt_deps',
-    bash_command=f'cd {DBT_PROJECT_DIR} && dbt deps --profiles-dir {DBT_PROFILES_DIR}',
+    bash_command=(
+        f'cd {DBT_PROJECT_DIR} && SENTINEL="{DBT_DEPS_SENTINEL}" && '
+        f'if [ -f "$SENTINEL" ] && [ -d dbt_packages ]; then echo "dbt packages up to date"; '
+        f'else dbt deps --profiles-dir {DBT_PROFILES_DIR} && touch "$SENTINEL"; fi'
+    ),
     dag=dag,
 )
 
-# Task 3: Run staging models
+# Task 3: Run staging, intermediate and marts models in one dbt invocation
+# dbt orders the layers by ref() dependencies and runs independent models in parallel threads
 # Note: dbt_debug removed - connection is implicitly tested by dbt run
-dbt_run_staging = BashOperator(
-    task_id='dbt_run_staging',
-    bash_command=f'cd {DBT_PROJECT_DIR} && dbt run --select tag:staging --profiles-dir {DBT_PROFILES_DIR}',
+dbt_run_models = BashOperator(
+    task_id='dbt_run_models',
+    bash_command=(
+        f'cd {DBT_PROJECT_DIR} && dbt run --select tag:staging tag:intermediate tag:marts '
+        f'--threads {DBT_THREADS} --profiles-dir {DBT_PROFILES_DIR}'
+    ),
     dag=dag,
 )
 
-parse_staging_results = PythonOperator(
-    task_id='parse_staging_results',
+parse_run_results = PythonOperator(
+    task_id='parse_run_results',
     python_callable=parse_dbt_results,
-    params={'task_id': 'staging'},
+    params={'task_id': 'run'},
     dag=dag,
 )
 
-# Task 6: Run intermediate models
-dbt_run_intermediate = BashOperator(
-    task_id='dbt_run_intermediate',
-    bash_command=f'cd {DBT_PROJECT_DIR} && dbt run --select tag:intermediate --profiles-dir {DBT_PROFILES_DIR}',
-    dag=dag,
-)
-
-parse_intermediate_results = PythonOperator(
-    task_id='parse_intermediate_results',
-    python_callable=parse_dbt_results,
-    params={'task_id': 'intermediate'},
-    dag=dag,
-)
-
-# Task 8: Run marts models
-dbt_run_marts = BashOperator(
-    task_id='dbt_run_marts',
-    bash_command=f'cd {DBT_PROJECT_DIR} && dbt run --select tag:marts --profiles-dir {DBT_PROFILES_DIR}',
-    dag=dag,
-)
-
-parse_marts_results = PythonOperator(
-    task_id='parse_marts_results',
-    python_callable=parse_dbt_results,
-    params={'task_id': 'marts'},
-    dag=dag,
-)
-
-# Task 10: Run dbt tests
+# Task 5: Run dbt tests
 dbt_test = BashOperator(
     task_id='dbt_test',
     bash_command=f'cd {DBT_PROJECT_DIR} && dbt test --profiles-dir {DBT_PROFILES_DIR}',
@@ -171,19 +180,10 @@ parse_test_results = PythonOperator(
     dag=dag,
 )
 
-# Task 12: Generate dbt documentation
-dbt_docs_generate = BashOperator(
-    task_id='dbt_docs_generate',
-    bash_command=f'cd {DBT_PROJECT_DIR} && dbt docs generate --profiles-dir {DBT_PROFILES_DIR}',
-    dag=dag,
-    trigger_rule='all_done',
-)
-
 # Task dependencies
-# Removed wait_for_s3_load sensor - dbt runs on schedule and data will be available
-# since s3_to_snowflake_load runs every 5 min (more frequent than dbt's 10 min)
+# No wait_for_s3_load sensor - this DAG is triggered by s3_to_snowflake_load after
+# its load completes, so a sensor would only hold a worker slot (or triggerer) for nothing
 # Removed dbt_debug - git check fails despite git being installed (overly strict check)
-check_dbt >> dbt_deps >> dbt_run_staging >> parse_staging_results
-parse_staging_results >> dbt_run_intermediate >> parse_intermediate_results
-parse_intermediate_results >> dbt_run_marts >> parse_marts_results
-parse_marts_results >> dbt_test >> parse_test_results >> dbt_docs_generate
+check_dbt >> dbt_deps >> dbt_run_models >> parse_run_results
+# Docs are generated hourly by the dbt_docs_fhir DAG, not after every run
+parse_run_results >> dbt_test >> parse_test_results
@@ -10,11 +10,33 @@ Dependencies: Triggered after s3_upload_patient_data DAG
 
 from datetime import datetime, timedelta
 from airflow import DAG
+from airflow.models import Variable
 from airflow.operators.python import PythonOperator
 from airflow.operators.trigger_dagrun import TriggerDagRunOperator
 from airflow.providers.snowflake.hooks.snowflake import SnowflakeHook
 from airflow.providers.amazon.aws.hooks.s3 import S3Hook
+import itertools
+import json
 import logging
+import os
+from pathlib import Path
+
+# Snowflake / S3 configuration (read once at DAG parse time)
+SNOWFLAKE_DATABASE = os.getenv('SNOWFLAKE_DATABASE', 'SYNTHEA')
+SNOWFLAKE_SCHEMA = os.getenv('SNOWFLAKE_SCHEMA', 'RAW')
+SNOWFLAKE_STORAGE_INTEGRATION = os.getenv('SNOWFLAKE_STORAGE_INTEGRATION', 'S3_FHIR_INTEGRATION')
+SNOWFLAKE_S3_ROLE_ARN = os.getenv('SNOWFLAKE_S3_ROLE_ARN', '')
+AWS_S3_BUCKET = os.getenv('AWS_S3_BUCKET', 'synthea-fhir-data-dump')
+AWS_S3_PREFIX = os.getenv('AWS_S3_PREFIX', 'raw')
+
+# Airflow Variable mirroring the latest LOAD_WATERMARK row
+WATERMARK_VARIABLE = 's3_to_snowflake_watermark'
+
+# Per-run key lists are kept on disk; only the file path goes through XCom
+LOAD_BATCH_DIR = Path('/opt/airflow/output/load_batches')
+
+# s3_upload_patient_data writes this object once every file of an uploaded_at= batch is in S3
+BATCH_COMPLETE_MARKER = '_COMPLETE'
 
 # Default arguments for the DAG
 default_args = {
@@ -41,19 +63,17 @@ dag = DAG(
 
 def create_snowflake_tables(**context):
     """
-    Create Snowflake tables if they don't exist:
+    Create Snowflake objects if they don't exist:
     - SYNTHEA.RAW.FHIR_BUNDLES: Stores FHIR bundle JSON data
     - SYNTHEA.RAW.LOAD_WATERMARK: Tracks last processed S3 file
+    - S3_FHIR_INTEGRATION: Storage integration granting Snowflake access to S3
+    - SYNTHEA.RAW.S3_FHIR_STAGE: External stage over the S3 patients prefix
     """
-    import os
-    
     hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
-    database = os.getenv('SNOWFLAKE_DATABASE', 'SYNTHEA')
-    schema = os.getenv('SNOWFLAKE_SCHEMA', 'RAW')
     
     # SQL to create FHIR_BUNDLES table
     create_bundles_table = f"""
-    CREATE TABLE IF NOT EXISTS {database}.{schema}.FHIR_BUNDLES (
+    CREATE TABLE IF NOT EXISTS {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.FHIR_BUNDLES (
         FILE_KEY VARCHAR(500) PRIMARY KEY,
         BUNDLE_DATA VARIANT,
         LOADED_AT TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP(),
@@ -64,7 +84,7 @@ def create_snowflake_tables(**context):
     
     # SQL to create LOAD_WATERMARK table
     create_watermark_table = f"""
-    CREATE TABLE IF NOT EXISTS {database}.{schema}.LOAD_WATERMARK (
+    CREATE TABLE IF NOT EXISTS {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.LOAD_WATERMARK (
         LOAD_ID NUMBER AUTOINCREMENT PRIMARY KEY,
         LAST_PROCESSED_KEY VARCHAR(500),
         LAST_PROCESSED_TIME TIMESTAMP_LTZ,
@@ -73,13 +93,35 @@ def create_snowflake_tables(**context):
     );
     """
     
+    # SQL to create the storage integration (IAM role based, no keys in SQL)
+    create_integration_sql = f"""
+    CREATE STORAGE INTEGRATION IF NOT EXISTS {SNOWFLAKE_STORAGE_INTEGRATION}
+    TYPE = EXTERNAL_STAGE
+    STORAGE_PROVIDER = 'S3'
+    ENABLED = TRUE
+    STORAGE_AWS_ROLE_ARN = '{SNOWFLAKE_S3_ROLE_ARN}'
+    STORAGE_ALLOWED_LOCATIONS = ('s3://{AWS_S3_BUCKET}/{AWS_S3_PREFIX}/');
+    """
+    
+    # SQL to create the S3 stage once (reused by every load run)
+    create_stage_sql = f"""
+    CREATE STAGE IF NOT EXISTS {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.S3_FHIR_STAGE
+    URL='s3://{AWS_S3_BUCKET}/{AWS_S3_PREFIX}/patients/'
+    STORAGE_INTEGRATION = {SNOWFLAKE_STORAGE_INTEGRATION}
+    FILE_FORMAT = (TYPE = 'JSON');
+    """
+    
     try:
         logging.info("Creating Snowflake tables if they don't exist...")
-        hook.run(create_bundles_table)
-        logging.info(f"✓ {database}.{schema}.FHIR_BUNDLES table ready")
-        
-        hook.run(create_watermark_table)
-        logging.info(f"✓ {database}.{schema}.LOAD_WATERMARK table ready")
+        # All DDL runs on a single connection
+        hook.run(
+            [create_bundles_table, create_watermark_table, create_integration_sql, create_stage_sql],
+            autocommit=True,
+        )
+        logging.info(f"✓ {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.FHIR_BUNDLES table ready")
+        logging.info(f"✓ {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.LOAD_WATERMARK table ready")
+        logging.info(f"✓ {SNOWFLAKE_STORAGE_INTEGRATION} storage integration ready")
+        logging.info(f"✓ {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.S3_FHIR_STAGE stage ready")
         
         return "Tables created successfully"
     except Exception as e:
@@ -87,26 +129,33 @@ def create_snowflake_tables(**context):
         raise
 
 
-def get_last_watermark(**context):
-    """
-    Retrieve the last processed S3 key from the watermark table.
-    Returns None if no watermark exists (first run).
-    """
-    import os
-    
+def _query_last_watermark():
+    """Read the latest watermark row from Snowflake."""
     hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
-    database = os.getenv('SNOWFLAKE_DATABASE', 'SYNTHEA')
-    schema = os.getenv('SNOWFLAKE_SCHEMA', 'RAW')
     
     query = f"""
     SELECT LAST_PROCESSED_KEY, LAST_PROCESSED_TIME 
-    FROM {database}.{schema}.LOAD_WATERMARK 
+    FROM {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.LOAD_WATERMARK 
     ORDER BY LOAD_ID DESC 
     LIMIT 1;
     """
     
+    return hook.get_first(query)
+
+
+def get_last_watermark(**context):
+    """
+    Retrieve the last processed S3 key.
+    Reads the watermark Variable first and only queries the watermark table
+    when the Variable is missing. Returns None if no watermark exists (first run).
+    """
+    last_key = Variable.get(WATERMARK_VARIABLE, default_var=None)
+    if last_key:
+        logging.info(f"Last watermark (from Variable): {last_key}")
+        return last_key
+    
     try:
-        result = hook.get_first(query)
+        result = _query_last_watermark()
         if result:
             last_key, last_time = result
             logging.info(f"Last watermark: {last_key} at {last_time}")
@@ -119,94 +168,126 @@ def get_last_watermark(**context):
         return None
 
 
+def _batch_name(key, prefix):
+    """Return the uploaded_at=... segment of an S3 key under prefix."""
+    return key[len(prefix):].split('/', 1)[0]
+
+
+def _batch_is_complete(batch, batch_keys, watermark_batch):
+    """
+    Check whether every file of a batch is in S3.
+    The watermark's own batch was complete when loading of it started.
+    """
+    if batch == watermark_batch:
+        return True
+    return any(key.endswith(f"/{BATCH_COMPLETE_MARKER}") for key in batch_keys)
+
+
 def list_new_s3_files(**context):
     """
     List S3 files that haven't been processed yet.
-    Returns list of file keys newer than the watermark.
-    """
-    import os
+    Writes the file keys newer than the watermark to LOAD_BATCH_DIR and
+    returns that file's path (None when there is nothing to load).
     
-    s3_hook = S3Hook(aws_conn_id='aws_default')
-    bucket = os.getenv('AWS_S3_BUCKET', 'synthea-fhir-data-dump')
-    prefix = os.getenv('AWS_S3_PREFIX', 'raw') + '/patients/'
+    Upload keys sort by upload time (patients/uploaded_at=.../), so S3 can
+    skip everything up to the watermark server-side via StartAfter.
+    Only complete batches are taken, and listing stops at the first batch
+    that is still uploading so the watermark never moves past its files.
+    """
+    s3_client = S3Hook(aws_conn_id='aws_default').get_conn()
+    prefix = f"{AWS_S3_PREFIX}/patients/"
     
     # Get last processed key from XCom
     ti = context['ti']
     last_watermark = ti.xcom_pull(task_ids='get_last_watermark')
     
     try:
-        # List all objects in the S3 prefix
-        all_keys = s3_hook.list_keys(bucket_name=bucket, prefix=prefix)
+        # List only objects after the watermark (keys are returned in lexicographic order)
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=AWS_S3_BUCKET, Prefix=prefix, StartAfter=last_watermark or prefix)
         
-        if not all_keys:
-            logging.info("No files found in S3")
-            return []
-        
-        # Filter for FHIR bundle files only (exclude .uploaded markers)
-        fhir_files = [key for key in all_keys if key.endswith('.json')]
-        
-        # If watermark exists, filter for newer files
-        if last_watermark:
-            # Get file metadata and filter by last modified time
-            new_files = []
-            for key in fhir_files:
-                if key not in last_watermark:  # Simple string comparison for now
-                    new_files.append(key)
-        else:
-            new_files = fhir_files
+        # Pages are fetched lazily, so listing stops once the batch is full
+        keys = (obj['Key'] for page in pages for obj in page.get('Contents', []))
+        watermark_batch = _batch_name(last_watermark, prefix) if last_watermark else None
         
         # Limit to 100 files per batch to avoid overwhelming Snowflake
-        new_files = new_files[:100]
+        new_files = []
+        for batch, batch_keys in itertools.groupby(keys, key=lambda key: _batch_name(key, prefix)):
+            batch_keys = list(batch_keys)
+            # Filter for FHIR bundle files only (exclude _COMPLETE markers)
+            batch_files = [key for key in batch_keys if key.endswith('.json.gz')]
+            if not batch_files:
+                continue
+            if not _batch_is_complete(batch, batch_keys, watermark_batch):
+                # Never load past a partial batch: its missing files are re-uploaded under
+                # the same prefix and would sort before the new watermark
+                logging.warning(f"Batch {batch} has no {BATCH_COMPLETE_MARKER} marker yet; "
+                                f"not loading it or any later batch until its upload completes")
+                break
+            new_files.extend(batch_files[:100 - len(new_files)])
+            if len(new_files) >= 100:
+                break
+        
+        if not new_files:
+            logging.info("No new files found in S3")
+            return None
         
         logging.info(f"Found {len(new_files)} new files to process")
-        return new_files
+        
+        LOAD_BATCH_DIR.mkdir(parents=True, exist_ok=True)
+        batch_path = LOAD_BATCH_DIR / f"{context['ts_nodash']}.json"
+        with open(batch_path, 'w') as f:
+            json.dump(new_files, f)
+        return str(batch_path)
         
     except Exception as e:
         logging.error(f"Error listing S3 files: {str(e)}")
         raise
 
 
+def _read_load_batch(ti):
+    """Return the S3 keys written by list_new_s3_files for this run (empty if none)."""
+    batch_path = ti.xcom_pull(task_ids='list_new_s3_files')
+    if not batch_path or not os.path.exists(batch_path):
+        return []
+    with open(batch_path, 'r') as f:
+        return json.load(f)
+
+
 def load_files_to_snowflake(**context):
     """
     Load new S3 files into Snowflake using COPY INTO command.
     Uses Snowflake's native S3 integration for efficient bulk loading.
+    Only the listed files are copied (FILES=...), so Snowflake does not
+    have to list the whole stage prefix on every run.
     """
-    import os
-    
     ti = context['ti']
-    new_files = ti.xcom_pull(task_ids='list_new_s3_files')
+    new_files = _read_load_batch(ti)
     
     if not new_files or len(new_files) == 0:
         logging.info("No new files to load - skipping")
         return {"files_loaded": 0}
     
     hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
-    bucket = os.getenv('AWS_S3_BUCKET', 'synthea-fhir-data-dump')
-    prefix = os.getenv('AWS_S3_PREFIX', 'raw')
-    database = os.getenv('SNOWFLAKE_DATABASE', 'SYNTHEA')
-    schema = os.getenv('SNOWFLAKE_SCHEMA', 'RAW')
-    aws_key_id = os.getenv('AWS_ACCESS_KEY_ID', '')
-    aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY', '')
     
-    # Create S3 stage for external access
-    create_stage_sql = f"""
-    CREATE OR REPLACE STAGE {database}.{schema}.S3_FHIR_STAGE
-    URL='s3://{bucket}/{prefix}/patients/'
-    CREDENTIALS=(AWS_KEY_ID='{aws_key_id}' AWS_SECRET_KEY='{aws_secret_key}')
-    FILE_FORMAT = (TYPE = 'JSON');
-    """
+    # FILES paths are relative to the stage URL (s3://bucket/{prefix}/patients/)
+    stage_root = f"{AWS_S3_PREFIX}/patients/"
+    files_list = ", ".join(
+        "'" + key[len(stage_root):].replace("'", "''") + "'" for key in new_files
+    )
     
     # COPY INTO command to load JSON files
     copy_into_sql = f"""
-    COPY INTO {database}.{schema}.FHIR_BUNDLES (FILE_KEY, BUNDLE_DATA, S3_LAST_MODIFIED)
+    COPY INTO {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.FHIR_BUNDLES (FILE_KEY, BUNDLE_DATA, S3_LAST_MODIFIED)
     FROM (
         SELECT 
             METADATA$FILENAME as FILE_KEY,
             $1 as BUNDLE_DATA,
             TO_TIMESTAMP_LTZ(METADATA$FILE_LAST_MODIFIED) as S3_LAST_MODIFIED
-        FROM @{database}.{schema}.S3_FHIR_STAGE
+        FROM @{SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.S3_FHIR_STAGE
     )
-    PATTERN = '.*\\.json'
+    FILES = ({files_list})
+    FILE_FORMAT = (TYPE = 'JSON' COMPRESSION = 'GZIP')
     ON_ERROR = 'CONTINUE'
     FORCE = FALSE;
     """
@@ -214,23 +295,22 @@ def load_files_to_snowflake(**context):
     try:
         logging.info(f"Loading {len(new_files)} files from S3 to Snowflake...")
         
-        # Create stage (will replace if exists)
-        hook.run(create_stage_sql)
-        logging.info("✓ S3 stage created")
-        
-        # Execute COPY INTO
-        result = hook.run(copy_into_sql)
+        # Execute COPY INTO; its result has one row per file with rows_loaded,
+        # so no extra COUNT(*) query against FHIR_BUNDLES is needed
+        result = hook.run(
+            copy_into_sql,
+            handler=lambda cursor: [
+                {col[0].lower(): value for col, value in zip(cursor.description, row)}
+                for row in cursor.fetchall()
+            ],
+        )
+        rows_loaded = sum(row.get('rows_loaded') or 0 for row in result)
         logging.info(f"✓ COPY INTO completed: {result}")
-        
-        # Count records loaded
-        count_query = f"SELECT COUNT(*) FROM {database}.{schema}.FHIR_BUNDLES;"
-        total_records = hook.get_first(count_query)[0]
-        
-        logging.info(f"Total records in FHIR_BUNDLES: {total_records}")
+        logging.info(f"Rows loaded into FHIR_BUNDLES: {rows_loaded}")
         
         return {
             "files_loaded": len(new_files),
-            "total_records": total_records
+            "rows_loaded": rows_loaded
         }
         
     except Exception as e:
@@ -242,10 +322,8 @@ def update_watermark(**context):
     """
     Update the watermark table with the latest processed file info.
     """
-    import os
-    
     ti = context['ti']
-    new_files = ti.xcom_pull(task_ids='list_new_s3_files')
+    new_files = _read_load_batch(ti)
     load_result = ti.xcom_pull(task_ids='load_files_to_snowflake')
     
     if not new_files or len(new_files) == 0:
@@ -253,21 +331,25 @@ def update_watermark(**context):
         return
     
     hook = SnowflakeHook(snowflake_conn_id='snowflake_default')
-    database = os.getenv('SNOWFLAKE_DATABASE', 'SYNTHEA')
-    schema = os.getenv('SNOWFLAKE_SCHEMA', 'RAW')
     
-    # Get the latest file key (assumes sorted)
-    last_key = sorted(new_files)[-1]
+    # Get the latest file key (keys sort by upload time)
+    last_key = max(new_files)
     files_count = load_result.get('files_loaded', 0)
     
+    # The connector escapes and interpolates the values client-side (default pyformat
+    # paramstyle), so keys with quotes such as O'Keefe are safe
     insert_watermark = f"""
-    INSERT INTO {database}.{schema}.LOAD_WATERMARK (LAST_PROCESSED_KEY, LAST_PROCESSED_TIME, FILES_PROCESSED)
-    VALUES ('{last_key}', CURRENT_TIMESTAMP(), {files_count});
+    INSERT INTO {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}.LOAD_WATERMARK (LAST_PROCESSED_KEY, LAST_PROCESSED_TIME, FILES_PROCESSED)
+    VALUES (%s, CURRENT_TIMESTAMP(), %s);
     """
     
     try:
-        hook.run(insert_watermark)
+        hook.run(insert_watermark, parameters=(last_key, files_count))
+        Variable.set(WATERMARK_VARIABLE, last_key)
         logging.info(f"✓ Watermark updated: {last_key} ({files_count} files)")
+        
+        # Batch is fully processed; drop its key list
+        os.remove(ti.xcom_pull(task_ids='list_new_s3_files'))
     except Exception as e:
         logging.error(f"Error updating watermark: {str(e)}")
         raise
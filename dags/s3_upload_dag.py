@@ -1,14 +1,17 @@
 """
 S3 Upload DAG for Synthea Patient Data
 """
-import json, logging, os
+import gzip, json, logging, os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List
+import orjson
 from airflow import DAG
 from airflow.operators.python import PythonOperator, BranchPythonOperator
 from airflow.providers.amazon.aws.hooks.s3 import S3Hook
 from airflow.utils.trigger_rule import TriggerRule
+from botocore.config import Config
 
 logger = logging.getLogger(__name__)
 BUNDLE_STORAGE_DIR = Path("/opt/airflow/output/bundles")
@@ -17,16 +20,24 @@ AWS_S3_PREFIX = os.getenv("AWS_S3_PREFIX", "raw")
 AWS_CONN_ID = os.getenv("AWS_CONN_ID", "aws_default")
 ENABLE_TRANSFORMATIONS = os.getenv("ENABLE_TRANSFORMATIONS", "false").lower() == "true"
 UPLOAD_MARKER = ".uploaded"
+# Batch prefix a folder was first uploaded under; reused so retries and re-uploads write the same keys
+UPLOAD_BATCH_FILE = ".upload_batch"
+# Written after every file of a batch prefix is uploaded; the loader only reads complete batches
+BATCH_COMPLETE_MARKER = "_COMPLETE"
+S3_UPLOAD_WORKERS = 16
 
 def scan_for_new_patients(**context):
     if not BUNDLE_STORAGE_DIR.exists():
         return []
     new_folders = []
-    for patient_dir in BUNDLE_STORAGE_DIR.iterdir():
-        if not patient_dir.is_dir() or (patient_dir / UPLOAD_MARKER).exists():
-            continue
-        if list(patient_dir.glob("*.json")):
-            new_folders.append(patient_dir.name)
+    # scandir yields cached d_type info and lets the .json probe stop at the first match
+    with os.scandir(BUNDLE_STORAGE_DIR) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) or os.path.exists(os.path.join(entry.path, UPLOAD_MARKER)):
+                continue
+            with os.scandir(entry.path) as files:
+                if any(f.name.endswith(".json") for f in files):
+                    new_folders.append(entry.name)
     context["task_instance"].xcom_push(key="new_patient_folders", value=new_folders)
     return new_folders
 
@@ -39,22 +50,59 @@ def transform_data(**context):
         return {"transformed_count": 0}
     for folder_name in new_folders:
         for json_file in (BUNDLE_STORAGE_DIR / folder_name).glob("*.json"):
-            with json_file.open("r") as f:
-                json.load(f)
+            orjson.loads(json_file.read_bytes())
     return {"transformed_count": len(new_folders)}
 
+def _upload_gzipped(client, local_path: str, s3_key: str) -> None:
+    # FHIR bundles compress ~10:1; Snowflake COPY reads the .gz objects directly
+    with open(local_path, "rb") as f:
+        body = gzip.compress(f.read(), compresslevel=6)
+    client.put_object(Bucket=AWS_S3_BUCKET, Key=s3_key, Body=body,
+                      ContentType="application/json", ContentEncoding="gzip")
+
+def _folder_batch_prefix(folder: Path, run_batch_prefix: str) -> str:
+    # A folder keeps the prefix of its first upload attempt, so an upload whose
+    # mark_as_uploaded never ran overwrites the same keys instead of duplicating them
+    batch_file = folder / UPLOAD_BATCH_FILE
+    if batch_file.exists():
+        return batch_file.read_text().strip()
+    batch_file.write_text(run_batch_prefix)
+    return run_batch_prefix
+
 def upload_to_s3(**context):
     new_folders = context["task_instance"].xcom_pull(task_ids="scan_for_new_patients", key="new_patient_folders")
     if not new_folders:
         return {"uploaded_folders": 0, "uploaded_files": 0}
-    s3_hook = S3Hook(aws_conn_id=AWS_CONN_ID)
-    uploaded_folders, uploaded_files = 0, 0
+    # One boto3 client shared by all workers (clients are thread-safe); botocore's pool
+    # defaults to 10 connections, so size it to the worker count
+    client = S3Hook(aws_conn_id=AWS_CONN_ID, config=Config(max_pool_connections=S3_UPLOAD_WORKERS)).get_conn()
+    # Keys sort by upload time so the Snowflake loader can resume with StartAfter; retries
+    # reuse each folder's recorded .upload_batch prefix rather than this one
+    run_batch_prefix = f"{AWS_S3_PREFIX}/patients/uploaded_at={datetime.utcnow():%Y%m%dT%H%M%SZ}"
+    uploads = []
+    batch_prefixes = set()
     for folder_name in new_folders:
-        for json_file in (BUNDLE_STORAGE_DIR / folder_name).glob("*.json"):
-            s3_key = f"{AWS_S3_PREFIX}/patients/{folder_name}/{json_file.name}"
-            s3_hook.load_file(str(json_file), s3_key, AWS_S3_BUCKET, replace=True)
+        batch_prefix = _folder_batch_prefix(BUNDLE_STORAGE_DIR / folder_name, run_batch_prefix)
+        batch_prefixes.add(batch_prefix)
+        uploads.extend(
+            (str(json_file), f"{batch_prefix}/{folder_name}/{json_file.name}.gz")
+            for json_file in (BUNDLE_STORAGE_DIR / folder_name).glob("*.json")
+        )
+    uploaded_files = 0
+    with ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS) as executor:
+        futures = {executor.submit(_upload_gzipped, client, local_path, s3_key): s3_key
+                   for local_path, s3_key in uploads}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                logger.error(f"Failed to upload s3://{AWS_S3_BUCKET}/{futures[future]}")
+                raise
             uploaded_files += 1
-        uploaded_folders += 1
+    # Every file succeeded; the batches can now be picked up by the loader
+    for batch_prefix in sorted(batch_prefixes):
+        client.put_object(Bucket=AWS_S3_BUCKET, Key=f"{batch_prefix}/{BATCH_COMPLETE_MARKER}", Body=b"")
+    uploaded_folders = len(new_folders)
     context["task_instance"].xcom_push(key="uploaded_folders", value=new_folders)
     return {"uploaded_folders": uploaded_folders, "uploaded_files": uploaded_files}
 
@@ -77,7 +125,7 @@ with DAG(
     schedule_interval="*/30 * * * *",
     start_date=datetime(2025, 1, 1),
     catchup=False,
-    max_active_runs=3,
+    max_active_runs=1,  # A newer batch must not complete while an older one is still uploading
     tags=["s3", "upload", "fhir", "aws"],
 ) as dag:
     scan = PythonOperator(task_id="scan_for_new_patients", python_callable=scan_for_new_patients)
@@ -12,41 +12,98 @@ DAG Configuration:
 
 Tasks:
 1. generate_patient: Executes Synthea JAR to create synthetic patient data
-2. extract_and_store_bundle: Extracts FHIR bundle and saves to organized directory
-3. cleanup_old_bundles: Removes bundles older than 24 hours (runs regardless of upstream failures)
-4. log_generation_summary: Logs patient demographics and generation statistics
+2. extract_and_store_bundle: Extracts each patient's FHIR bundle, saves it to an organized
+   directory and logs patient demographics and generation statistics
+
+A second DAG in this file, synthea_bundle_cleanup, runs cleanup_old_bundles hourly
+to remove bundles older than 24 hours.
 
 Author: Apache Airflow POC
 Version: 1.0.0
 """
 
+import errno
 import json
 import logging
 import os
+import re
 import shutil
 import subprocess
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 from airflow import DAG
 from airflow.operators.python import PythonOperator
-from airflow.utils.trigger_rule import TriggerRule
+import orjson
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Synthea configuration
 SYNTHEA_JAR = Path("/opt/synthea/synthea-with-dependencies.jar")
-SYNTHEA_OUTPUT_DIR = Path("/opt/synthea/output")
+# AppCDS archive built into the image; the JVM maps pre-parsed classes instead of loading them
+SYNTHEA_CDS_ARCHIVE = Path("/opt/synthea/synthea.jsa")
+# Synthea writes onto the same volume as the bundle store so files can be moved by rename;
+# each run gets its own SYNTHEA_OUTPUT_DIR/<seed> directory
+SYNTHEA_OUTPUT_DIR = Path("/opt/airflow/output/synthea")
+# Run directories older than this are swept by cleanup (runs finish within 5 minutes)
+SYNTHEA_RUN_DIR_RETENTION_SECONDS = 60 * 60
 BUNDLE_STORAGE_DIR = Path("/opt/airflow/output/bundles")
 
+# Synthea runs one JVM per DAG run; generating several patients amortizes its startup
+SYNTHEA_PATIENTS_PER_RUN = 10
+
+# Synthea command, built once; the per-run seed and output directory are appended
+# -XX:SharedArchiveFile: Start from the class data archive (ignored if missing)
+# --exporter.fhir.use_us_core_ig true: Use US Core Implementation Guide profiles
+# --exporter.{csv,text,metadata}.export false: Skip exporters nothing downstream reads
+#   (US Core profiles and hospital/practitioner files stay - the dbt models use them)
+# -p <n>: Generate SYNTHEA_PATIENTS_PER_RUN patients
+# -s <seed>: Reproducible seed for this generation
+# --exporter.baseDirectory <dir>: Write output under SYNTHEA_OUTPUT_DIR/<seed> (appended per run)
+SYNTHEA_CMD_PREFIX = (
+    "java",
+    f"-XX:SharedArchiveFile={SYNTHEA_CDS_ARCHIVE}",
+    "-jar",
+    str(SYNTHEA_JAR),
+    "--exporter.fhir.use_us_core_ig",
+    "true",
+    "--exporter.csv.export",
+    "false",
+    "--exporter.text.export",
+    "false",
+    "--exporter.metadata.export",
+    "false",
+    "-p",
+    str(SYNTHEA_PATIENTS_PER_RUN),
+    "-s",
+)
+SYNTHEA_CWD = str(SYNTHEA_JAR.parent)
+
+# Hospital/practitioner files are written once per Synthea run, not per patient
+SHARED_FILE_PREFIXES = ("hospitalInformation", "practitionerInformation")
+
+# Patient bundle filename: {FirstName}{Num}_{LastName}{Num}_{patient_id}
+# Names are matched up to their trailing digits, so accented or hyphenated names still parse
+PATIENT_FILENAME_RE = re.compile(r"^([^_]+?\d+)_([^_]+?\d+)_(.+)$")
+
+# Raw-byte patterns for the summary fast path (Synthea writes resourceType first and
+# top-level Patient fields before any nested resource)
+PATIENT_RESOURCE_RE = re.compile(rb'"resourceType"\s*:\s*"Patient"')
+PATIENT_FIELD_RES = {
+    field: re.compile(rb'"' + field.encode() + rb'"\s*:\s*"((?:[^"\\]|\\.)*)"')
+    for field in ("id", "gender", "birthDate", "family")
+}
+PATIENT_GIVEN_RE = re.compile(rb'"given"\s*:\s*\[([^\]]*)\]')
+JSON_STRING_RE = re.compile(rb'"((?:[^"\\]|\\.)*)"')
+
 # Ensure storage directory exists
 BUNDLE_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def generate_patient_data(**context) -> Dict[str, str]:
+def generate_patient_data(**context) -> int:
     """
     Generate synthetic patient data using Synthea JAR.
     
@@ -54,7 +111,7 @@ def generate_patient_data(**context) -> Dict[str, str]:
     Executes Synthea with US Core R4 FHIR export enabled.
     
     Returns:
-        Dict containing execution metadata (seed, timestamp, output_dir)
+        Seed used for this generation
     
     Raises:
         RuntimeError: If Synthea execution fails
@@ -62,58 +119,34 @@ def generate_patient_data(**context) -> Dict[str, str]:
     try:
         # Generate unique seed based on current time (milliseconds)
         seed = int(time.time() * 1000)
-        execution_time = datetime.now()
         
         logger.info(f"Starting Synthea patient generation with seed: {seed}")
         
-        # Clean previous output to avoid conflicts
-        if SYNTHEA_OUTPUT_DIR.exists():
-            logger.info(f"Cleaning previous output directory: {SYNTHEA_OUTPUT_DIR}")
-            shutil.rmtree(SYNTHEA_OUTPUT_DIR)
-        SYNTHEA_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-        
-        # Build Synthea command
-        # -p 1: Generate 1 patient
-        # --exporter.fhir.use_us_core_ig true: Use US Core Implementation Guide profiles
-        # -s <seed>: Reproducible seed for this generation
-        cmd = [
-            "java",
-            "-jar",
-            str(SYNTHEA_JAR),
-            "--exporter.fhir.use_us_core_ig",
-            "true",
-            "-p",
-            "1",
-            "-s",
-            str(seed),
-        ]
+        # Fresh directory per run, so earlier output never needs clearing first
+        run_dir = SYNTHEA_OUTPUT_DIR / str(seed)
+        run_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Constant Synthea arguments plus this run's seed and output directory
+        cmd = [*SYNTHEA_CMD_PREFIX, str(seed), "--exporter.baseDirectory", str(run_dir)]
         
         logger.info(f"Executing Synthea command: {' '.join(cmd)}")
         
         # Execute Synthea with timeout (5 minutes max)
-        result = subprocess.run(
+        # Synthea's progress output is discarded; stderr is kept for the failure log
+        subprocess.run(
             cmd,
-            cwd=str(SYNTHEA_OUTPUT_DIR.parent),
-            capture_output=True,
+            cwd=SYNTHEA_CWD,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
             text=True,
             timeout=300,
             check=True,
         )
         
         logger.info(f"Synthea execution completed successfully")
-        logger.debug(f"Synthea stdout: {result.stdout[:500]}")
-        
-        # Store execution metadata for downstream tasks
-        metadata = {
-            "seed": str(seed),
-            "execution_time": execution_time.isoformat(),
-            "output_dir": str(SYNTHEA_OUTPUT_DIR),
-        }
         
-        # Push metadata to XCom for downstream tasks
-        context["task_instance"].xcom_push(key="generation_metadata", value=metadata)
-        
-        return metadata
+        # The seed identifies this run's output directory (SYNTHEA_OUTPUT_DIR/<seed>)
+        return seed
         
     except subprocess.TimeoutExpired as e:
         logger.error(f"Synthea execution timed out after 300 seconds")
@@ -127,128 +160,140 @@ def generate_patient_data(**context) -> Dict[str, str]:
         raise
 
 
-def extract_and_store_bundle(**context) -> Optional[str]:
+def extract_and_store_bundle(**context) -> List[str]:
     """
     Extract all generated FHIR files and store in organized directory structure.
     
-    Synthea generates 3 files with patterns:
-    1. hospitalInformation{timestamp}.json - Hospital info
-    2. {FirstName}{Num}_{LastName}{Num}_{patient_id}.json - Patient bundle (has person's name)
-    3. practitionerInformation{timestamp}.json - Practitioner info
+    Synthea generates files with patterns:
+    1. hospitalInformation{timestamp}.json - Hospital info (shared by the batch)
+    2. {FirstName}{Num}_{LastName}{Num}_{patient_id}.json - Patient bundle, one per patient
+    3. practitionerInformation{timestamp}.json - Practitioner info (shared by the batch)
     
-    Stores all files in: /opt/airflow/output/bundles/{patient_id}_{patient_name}/*.json
+    Stores each patient with the shared files in:
+    /opt/airflow/output/bundles/{patient_id}_{patient_name}/*.json
     
     Returns:
-        Path to patient bundle file, or None if not found
+        Paths to the stored patient bundle files
     
     Raises:
         FileNotFoundError: If no FHIR files found in output
     """
     try:
-        # Retrieve generation metadata from previous task
-        metadata = context["task_instance"].xcom_pull(
-            task_ids="generate_patient",
-            key="generation_metadata"
-        )
-        
-        if not metadata:
-            logger.warning("No generation metadata found, using defaults")
-            execution_time = datetime.now()
-        else:
-            execution_time = datetime.fromisoformat(metadata["execution_time"])
+        # Locate this run's output directory from the seed returned by generate_patient
+        seed = context["task_instance"].xcom_pull(task_ids="generate_patient")
+        if seed is None:
+            error_msg = "No seed from generate_patient; cannot locate Synthea output"
+            logger.error(error_msg)
+            raise FileNotFoundError(error_msg)
+        run_dir = SYNTHEA_OUTPUT_DIR / str(seed)
         
-        logger.info("Searching for generated FHIR files")
+        logger.info(f"Searching for generated FHIR files in {run_dir}")
         
         # Search for FHIR files in output directories
         source_dir = None
         json_files = []
         
         for subdir in ["fhir_r4", "fhir"]:
-            search_dir = SYNTHEA_OUTPUT_DIR / subdir
+            search_dir = run_dir / subdir
             if search_dir.exists():
-                json_files = list(search_dir.glob("*.json"))
+                with os.scandir(search_dir) as entries:
+                    json_files = [
+                        Path(e.path) for e in entries
+                        if e.name.endswith(".json") and e.is_file()
+                    ]
                 if json_files:
                     source_dir = search_dir
-                    logger.info(f"Found {len(json_files)} FHIR files in: {search_dir}")
-                    for f in json_files:
-                        logger.info(f"  - {f.name}")
+                    logger.info(
+                        f"Found {len(json_files)} FHIR files in {search_dir}: "
+                        f"{[f.name for f in json_files]}"
+                    )
                     break
         
         if not json_files:
-            error_msg = f"No FHIR files found in {SYNTHEA_OUTPUT_DIR}"
+            error_msg = f"No FHIR files found in {run_dir}"
             logger.error(error_msg)
             raise FileNotFoundError(error_msg)
         
-        # Identify the patient bundle file by filename pattern
-        # Patient bundle has person's name pattern (not starting with hospital/practitioner)
-        patient_bundle_file = None
-        
-        for json_file in json_files:
-            filename = json_file.name
-            # Patient file doesn't start with "hospital" or "practitioner"
-            if not filename.startswith("hospitalInformation") and \
-               not filename.startswith("practitionerInformation"):
-                patient_bundle_file = json_file
-                logger.info(f"Identified patient bundle: {filename}")
-                break
+        # Identify patient bundles by filename pattern
+        # Patient bundles have the person's name pattern; hospital/practitioner files are shared by the batch
+        patient_bundle_files = [f for f in json_files if not f.name.startswith(SHARED_FILE_PREFIXES)]
+        shared_files = [f for f in json_files if f.name.startswith(SHARED_FILE_PREFIXES)]
         
-        if not patient_bundle_file:
+        if not patient_bundle_files:
             error_msg = "No patient bundle found among generated files"
             logger.error(error_msg)
             logger.error(f"Available files: {[f.name for f in json_files]}")
             raise FileNotFoundError(error_msg)
         
-        # Parse patient info from filename
-        # Pattern: {FirstName}{Num}_{LastName}{Num}_{patient_id}.json
-        # Example: Justin359_Roob72_b5ceadaf-3f35-da2f-1017-741e00f0e3dc.json
-        filename = patient_bundle_file.stem  # Remove .json extension
-        parts = filename.split("_")
-        
-        if len(parts) >= 3:
-            # First part: FirstName with numbers (e.g., Justin359)
-            # Second part: LastName with numbers (e.g., Roob72)
-            # Remaining parts: patient_id (UUID with hyphens)
-            first_name_part = parts[0]
-            last_name_part = parts[1]
-            patient_id = "_".join(parts[2:])  # Join remaining parts for UUID
+        logger.info(f"Identified {len(patient_bundle_files)} patient bundles")
+        
+        bundle_paths = []
+        patient_folders = []
+        for patient_bundle_file in patient_bundle_files:
+            # Parse patient info from filename
+            # Pattern: {FirstName}{Num}_{LastName}{Num}_{patient_id}.json
+            # Example: Justin359_Roob72_b5ceadaf-3f35-da2f-1017-741e00f0e3dc.json
+            filename = patient_bundle_file.stem  # Remove .json extension
+            match = PATIENT_FILENAME_RE.match(filename)
             
-            # Extract clean names (remove trailing numbers if desired, or keep as-is)
-            patient_name = f"{first_name_part}_{last_name_part}"
+            if match:
+                # FirstName with numbers (e.g., Justin359), LastName with numbers (e.g., Roob72),
+                # then patient_id (UUID with hyphens)
+                first_name_part, last_name_part, patient_id = match.groups()
+                
+                # Extract clean names (remove trailing numbers if desired, or keep as-is)
+                patient_name = f"{first_name_part}_{last_name_part}"
+                
+                logger.debug(f"Extracted patient info - Name: {patient_name}, ID: {patient_id}")
+            else:
+                # Fallback if pattern doesn't match
+                logger.warning(f"Unexpected filename pattern: {filename}")
+                patient_name = "unknown"
+                patient_id = filename
             
-            logger.info(f"Extracted patient info - Name: {patient_name}, ID: {patient_id}")
-        else:
-            # Fallback if pattern doesn't match
-            logger.warning(f"Unexpected filename pattern: {filename}")
-            patient_name = "unknown"
-            patient_id = filename
-        
-        # Create folder named: {patient_id}_{patient_name}
-        folder_name = f"{patient_id}_{patient_name}"
-        patient_dir = BUNDLE_STORAGE_DIR / folder_name
-        patient_dir.mkdir(parents=True, exist_ok=True)
-        
-        logger.info(f"Created storage directory: {patient_dir}")
-        
-        # Copy all JSON files to the patient directory
-        copied_files = []
-        for json_file in json_files:
-            dest_path = patient_dir / json_file.name
-            shutil.copy2(json_file, dest_path)
-            copied_files.append(dest_path)
-            logger.info(f"Copied: {json_file.name} -> {dest_path}")
-        
-        logger.info(f"Successfully stored {len(copied_files)} files in {patient_dir}")
-        
-        # Verify all 3 files are present
-        if len(copied_files) != 3:
-            logger.warning(f"Expected 3 files but found {len(copied_files)}")
+            # Create folder named: {patient_id}_{patient_name}
+            folder_name = f"{patient_id}_{patient_name}"
+            patient_dir = BUNDLE_STORAGE_DIR / folder_name
+            patient_dir.mkdir(parents=True, exist_ok=True)
+            
+            logger.debug(f"Created storage directory: {patient_dir}")
+            
+            # Move the patient bundle (same volume, so a rename - no data copy)
+            patient_bundle_dest = patient_dir / patient_bundle_file.name
+            os.replace(patient_bundle_file, patient_bundle_dest)
+            stored_files = [patient_bundle_dest]
+            logger.debug(f"Moved: {patient_bundle_file.name} -> {patient_bundle_dest}")
+            
+            # Each patient folder gets the shared hospital/practitioner files as hardlinks
+            # (no data copy); copy only when the output and storage dirs are on different devices
+            for shared_file in shared_files:
+                dest_path = patient_dir / shared_file.name
+                try:
+                    os.link(shared_file, dest_path)
+                    logger.debug(f"Linked: {shared_file.name} -> {dest_path}")
+                except FileExistsError:
+                    logger.debug(f"Already stored: {dest_path}")
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.copy2(shared_file, dest_path)
+                    logger.debug(f"Copied: {shared_file.name} -> {dest_path}")
+                stored_files.append(dest_path)
+            
+            logger.debug(f"Stored {len(stored_files)} files in {patient_dir}")
+            
+            # Verify all 3 files are present
+            if len(stored_files) != 3:
+                logger.warning(f"Expected 3 files but found {len(stored_files)}")
+            
+            bundle_paths.append(str(patient_bundle_dest))
+            patient_folders.append(str(patient_dir))
+            
+            log_bundle_summary(str(patient_bundle_dest))
         
-        # Store patient bundle path for downstream tasks
-        patient_bundle_dest = patient_dir / patient_bundle_file.name
-        context["task_instance"].xcom_push(key="bundle_path", value=str(patient_bundle_dest))
-        context["task_instance"].xcom_push(key="patient_folder", value=str(patient_dir))
+        logger.info(f"Successfully stored {len(patient_folders)} patient folders in {BUNDLE_STORAGE_DIR}")
         
-        return str(patient_bundle_dest)
+        return bundle_paths
         
     except FileNotFoundError:
         raise
@@ -265,16 +310,19 @@ def cleanup_old_bundles(**context) -> Dict[str, int]:
     Remove patient folders older than 24 hours.
     
     Scans storage directory and deletes entire patient folders (with all files)
-    if any file has modification time > 24 hours ago.
-    Runs regardless of upstream task failures (trigger_rule='all_done').
+    once every file has modification time > 24 hours ago. Also sweeps Synthea
+    run directories (SYNTHEA_OUTPUT_DIR/<seed>) older than an hour.
+    Runs hourly in the synthea_bundle_cleanup DAG.
     
     Returns:
-        Dict with cleanup statistics (deleted_folders, deleted_files, errors_count)
+        Dict with cleanup statistics (deleted_folders, deleted_files, deleted_run_dirs, errors_count)
     """
     try:
-        cutoff_time = time.time() - (24 * 60 * 60)  # 24 hours ago in seconds
+        now = time.time()
+        cutoff_time = now - (24 * 60 * 60)  # 24 hours ago in seconds
         deleted_folders = 0
         deleted_files = 0
+        deleted_run_dirs = 0
         error_count = 0
         
         logger.info(f"Starting cleanup of patient folders older than 24 hours")
@@ -283,104 +331,175 @@ def cleanup_old_bundles(**context) -> Dict[str, int]:
         # Walk through all patient folders
         if not BUNDLE_STORAGE_DIR.exists():
             logger.info("Bundle storage directory does not exist, nothing to clean")
-            return {"deleted_folders": 0, "deleted_files": 0, "error_count": 0}
+            return {"deleted_folders": 0, "deleted_files": 0, "deleted_run_dirs": 0, "error_count": 0}
         
-        for patient_dir in BUNDLE_STORAGE_DIR.iterdir():
-            if not patient_dir.is_dir():
-                continue
-            
-            try:
-                # Check if any file in the folder is older than 24 hours
-                folder_should_delete = False
-                oldest_file_age = 0
+        # os.scandir entries cache the file type, so is_dir() needs no extra stat
+        with os.scandir(BUNDLE_STORAGE_DIR) as patient_entries:
+            for patient_entry in patient_entries:
+                if not patient_entry.is_dir(follow_symlinks=False):
+                    continue
                 
-                for file_path in patient_dir.glob("*.json"):
-                    file_mtime = file_path.stat().st_mtime
-                    file_age_hours = (time.time() - file_mtime) / 3600
-                    
-                    if file_mtime < cutoff_time:
-                        folder_should_delete = True
-                        oldest_file_age = max(oldest_file_age, file_age_hours)
-                
-                if folder_should_delete:
-                    # Count files before deletion
-                    file_count = len(list(patient_dir.glob("*.json")))
-                    
-                    logger.info(
-                        f"Deleting patient folder: {patient_dir.name} "
-                        f"({file_count} files, oldest: {oldest_file_age:.1f} hours)"
-                    )
-                    
-                    # Delete entire folder with all contents
-                    shutil.rmtree(patient_dir)
-                    deleted_folders += 1
-                    deleted_files += file_count
+                try:
+                    # List the folder once; it is old when its newest file is older than 24 hours
+                    with os.scandir(patient_entry.path) as it:
+                        file_entries = list(it)
+                    mtimes = [
+                        f.stat(follow_symlinks=False).st_mtime
+                        for f in file_entries
+                        if f.name.endswith(".json")
+                    ]
+                    newest_mtime = max(mtimes, default=0)
+                    folder_should_delete = bool(mtimes) and newest_mtime < cutoff_time
                     
-            except Exception as e:
-                logger.error(f"Error deleting folder {patient_dir}: {str(e)}")
-                error_count += 1
+                    if folder_should_delete:
+                        file_count = len(mtimes)
+                        oldest_file_age = (now - min(mtimes)) / 3600
+                        
+                        logger.debug(
+                            f"Deleting patient folder: {patient_entry.name} "
+                            f"({file_count} files, oldest: {oldest_file_age:.1f} hours)"
+                        )
+                        
+                        # Delete the files already listed (incl. .uploaded markers), then the folder
+                        for file_entry in file_entries:
+                            try:
+                                os.unlink(file_entry.path)
+                            except FileNotFoundError:
+                                pass
+                        os.rmdir(patient_entry.path)
+                        deleted_folders += 1
+                        deleted_files += file_count
+                        
+                except Exception as e:
+                    logger.error(f"Error deleting folder {patient_entry.path}: {str(e)}")
+                    error_count += 1
+        
+        # Sweep Synthea run directories (leftover shared-file names, output of failed extracts)
+        if SYNTHEA_OUTPUT_DIR.exists():
+            run_cutoff_time = now - SYNTHEA_RUN_DIR_RETENTION_SECONDS
+            with os.scandir(SYNTHEA_OUTPUT_DIR) as run_entries:
+                for run_entry in run_entries:
+                    try:
+                        if (
+                            run_entry.is_dir(follow_symlinks=False)
+                            and run_entry.stat(follow_symlinks=False).st_mtime < run_cutoff_time
+                        ):
+                            shutil.rmtree(run_entry.path)
+                            deleted_run_dirs += 1
+                    except Exception as e:
+                        logger.error(f"Error deleting run directory {run_entry.path}: {str(e)}")
+                        error_count += 1
         
         logger.info(
             f"Cleanup completed: {deleted_folders} folders deleted "
-            f"({deleted_files} files), {error_count} errors"
+            f"({deleted_files} files), {deleted_run_dirs} run directories deleted, "
+            f"{error_count} errors"
         )
         
         return {
             "deleted_folders": deleted_folders,
             "deleted_files": deleted_files,
+            "deleted_run_dirs": deleted_run_dirs,
             "error_count": error_count
         }
         
     except Exception as e:
         logger.error(f"Unexpected error during cleanup: {str(e)}")
-        return {"deleted_folders": 0, "deleted_files": 0, "error_count": 1}
+        return {"deleted_folders": 0, "deleted_files": 0, "deleted_run_dirs": 0, "error_count": 1}
+
 
+def _decode_json_string(raw: bytes) -> str:
+    """Decode the body of a JSON string literal (handles escapes such as \\u00e9)."""
+    return orjson.loads(b'"' + raw + b'"')
 
-def log_generation_summary(**context) -> None:
+
+def _scan_bundle_fast(data: bytes) -> Optional[Tuple[Dict[str, str], int]]:
+    """
+    Extract Patient demographics and the entry count from raw bundle bytes without parsing.
+    
+    Searches only the Patient resource block (up to the next resourceType) and counts
+    entries by their fullUrl keys, which appear once per entry.
+    
+    Returns:
+        Tuple of (patient info, number of bundle entries), or None if the Patient block
+        doesn't have the expected fields
+    """
+    start = PATIENT_RESOURCE_RE.search(data)
+    if not start:
+        return None
+    end = data.find(b'"resourceType"', start.end())
+    block = data[start.end():end if end != -1 else len(data)]
+    
+    matches = {field: regex.search(block) for field, regex in PATIENT_FIELD_RES.items()}
+    if not (matches["id"] and matches["gender"] and matches["birthDate"]):
+        return None
+    
+    patient_info = {
+        field: _decode_json_string(matches[field].group(1))
+        for field in ("id", "gender", "birthDate")
+    }
+    
+    # Name comes from the first (official) name entry
+    given_match = PATIENT_GIVEN_RE.search(block)
+    given = " ".join(
+        _decode_json_string(g) for g in JSON_STRING_RE.findall(given_match.group(1))
+    ) if given_match else ""
+    family = _decode_json_string(matches["family"].group(1)) if matches["family"] else ""
+    patient_info["name"] = f"{given} {family}".strip() or "unknown"
+    
+    return patient_info, data.count(b'"fullUrl"')
+
+
+def _scan_bundle(bundle: Dict) -> Tuple[Dict[str, str], int]:
     """
-    Log summary of patient generation including demographics and file information.
+    Extract Patient demographics and the entry count from a parsed FHIR bundle.
     
-    Reads the generated bundle and extracts key patient information for logging.
+    Returns:
+        Tuple of (patient info, number of bundle entries)
+    """
+    patient_info = {"id": "unknown", "name": "unknown", "gender": "unknown", "birthDate": "unknown"}
+    entries = bundle.get("entry", [])
+    patient = next(
+        (e["resource"] for e in entries if e.get("resource", {}).get("resourceType") == "Patient"),
+        None,
+    )
+    
+    if patient:
+        patient_info["id"] = patient.get("id", "unknown")
+        patient_info["gender"] = patient.get("gender", "unknown")
+        patient_info["birthDate"] = patient.get("birthDate", "unknown")
+        
+        # Extract name
+        names = patient.get("name", [])
+        if names:
+            name = names[0]
+            given = " ".join(name.get("given", []))
+            family = name.get("family", "")
+            patient_info["name"] = f"{given} {family}".strip()
+    
+    return patient_info, len(entries)
+
+
+def log_bundle_summary(bundle_path: str) -> None:
+    """
+    Log summary of a stored patient bundle including demographics and file information.
+    
+    Called by extract_and_store_bundle for each bundle it stores; errors are logged,
+    not raised, since the summary is informational only.
     """
     try:
-        bundle_path = context["task_instance"].xcom_pull(
-            task_ids="extract_and_store_bundle",
-            key="bundle_path"
-        )
+        # Read bundle once; scan the raw bytes and only parse when the scan fails
+        with open(bundle_path, "rb") as f:
+            data = f.read()
         
-        if not bundle_path or not Path(bundle_path).exists():
-            logger.warning("No bundle path found, skipping summary")
-            return
-        
-        # Read bundle
-        with open(bundle_path, "r") as f:
-            bundle = json.load(f)
-        
-        # Extract patient information
-        patient_info = {"id": "unknown", "name": "unknown", "gender": "unknown", "birthDate": "unknown"}
-        
-        if "entry" in bundle:
-            for entry in bundle["entry"]:
-                resource = entry.get("resource", {})
-                if resource.get("resourceType") == "Patient":
-                    patient_info["id"] = resource.get("id", "unknown")
-                    patient_info["gender"] = resource.get("gender", "unknown")
-                    patient_info["birthDate"] = resource.get("birthDate", "unknown")
-                    
-                    # Extract name
-                    names = resource.get("name", [])
-                    if names:
-                        name = names[0]
-                        given = " ".join(name.get("given", []))
-                        family = name.get("family", "")
-                        patient_info["name"] = f"{given} {family}".strip()
-                    break
-        
-        # Count resources in bundle
-        resource_count = len(bundle.get("entry", []))
+        result = _scan_bundle_fast(data)
+        if result is None:
+            logger.info(f"Patient fields not found by scan, parsing bundle: {bundle_path}")
+            result = _scan_bundle(orjson.loads(data))
+        patient_info, resource_count = result
         
         # Calculate file size
-        file_size_kb = Path(bundle_path).stat().st_size / 1024
+        file_size_kb = len(data) / 1024
         
         # Log comprehensive summary
         logger.info("=" * 80)
@@ -396,7 +515,7 @@ def log_generation_summary(**context) -> None:
         logger.info("=" * 80)
         
     except Exception as e:
-        logger.error(f"Error generating summary: {str(e)}")
+        logger.error(f"Error generating summary for {bundle_path}: {str(e)}")
         # Don't raise - this is just logging, not critical
 
 
@@ -432,7 +551,7 @@ with DAG(
         
         Executes Synthea JAR to generate synthetic patient data:
         - Uses timestamp-based seed for randomness
-        - Generates 1 patient per run
+        - Generates 10 patients per run (SYNTHEA_PATIENTS_PER_RUN) in one JVM
         - Exports FHIR R4 bundle with US Core profiles
         - Timeout: 5 minutes
         """,
@@ -447,16 +566,31 @@ with DAG(
         
         Extracts all generated FHIR files and stores in patient-specific folder:
         - Searches for all JSON files in Synthea output (practitioner, hospital, patient)
-        - Extracts patient ID and name from patient bundle
-        - Stores in: bundles/{patient_id}_{patient_name}/*.json (all 3 files)
+        - Extracts patient ID and name from each patient bundle
+        - Stores each patient in: bundles/{patient_id}_{patient_name}/*.json (bundle + shared hospital/practitioner files)
+        - Logs a summary per patient (demographics, resource count, bundle size)
         """,
     )
     
-    # Task 3: Cleanup old patient folders (runs even if upstream fails)
+    # Define task dependencies
+    generate_patient >> extract_bundle
+
+
+# Cleanup only acts on 24-hour-old folders, so it runs on its own hourly schedule
+with DAG(
+    dag_id="synthea_bundle_cleanup",
+    default_args=default_args,
+    description="Remove Synthea patient folders older than 24 hours",
+    schedule_interval="@hourly",
+    start_date=datetime(2025, 1, 1),
+    catchup=False,
+    max_active_runs=1,
+    tags=["synthea", "fhir", "healthcare", "poc", "cleanup"],
+) as cleanup_dag:
+    
     cleanup_bundles = PythonOperator(
         task_id="cleanup_old_bundles",
         python_callable=cleanup_old_bundles,
-        trigger_rule=TriggerRule.ALL_DONE,  # Run regardless of upstream status
         doc_md="""
         ### Cleanup Old Patient Folders
         
@@ -464,24 +598,6 @@ with DAG(
         - Scans all patient folders in storage directory
         - Deletes entire folders (with all 3 JSON files) if older than 24 hours
         - Folder structure: {patient_id}_{patient_name}/
-        - Runs regardless of upstream task status
-        """,
-    )
-    
-    # Task 4: Log generation summary
-    log_summary = PythonOperator(
-        task_id="log_generation_summary",
-        python_callable=log_generation_summary,
-        doc_md="""
-        ### Log Generation Summary
-        
-        Logs comprehensive patient generation summary:
-        - Patient demographics (name, ID, gender, birth date)
-        - Resource count in bundle
-        - Bundle file size
-        - Storage location
+        - Also removes Synthea run directories (synthea/<seed>/) older than 1 hour
         """,
     )
-    
-    # Define task dependencies
-    generate_patient >> extract_bundle >> [cleanup_bundles, log_summary]